@@ -1,8 +1,13 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
+import plotly.graph_objects as go
+from plotly.colors import qualitative
+from plotly.subplots import make_subplots
 from io import BytesIO
+from pathlib import Path
+import hashlib
+import tempfile
 
 # --------------------
 # Config
@@ -21,9 +26,40 @@ if not (inv_file and for_file):
     st.info("Carga los dos archivos Excel para comenzar (inventario y pronóstico).")
     st.stop()
 
+# Leer Excel una sola vez por archivo (cacheado por contenido; los reruns de widgets no vuelven a parsear)
+# y guardar el resultado en Parquet en disco, para no volver a parsear el mismo archivo entre sesiones
+CACHE_DIR = Path.home() / ".cache" / "reorden"
+
+@st.cache_data(show_spinner=False)
+def load_excel(file_bytes):
+    path = CACHE_DIR / f"{hashlib.sha1(file_bytes).hexdigest()}.parquet"
+    if path.exists():
+        try:
+            return pd.read_parquet(path)
+        except (ImportError, OSError, ValueError):
+            # Parquet dañado o ilegible: se descarta y se vuelve a leer el Excel
+            path.unlink(missing_ok=True)
+    df = pd.read_excel(BytesIO(file_bytes))
+    tmp = None
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # archivo temporal único por escritura: dos sesiones con el mismo archivo no se pisan
+        with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as f:
+            tmp = Path(f.name)
+            df.to_parquet(f, index=False)
+        tmp.replace(path)
+    except (ImportError, OSError, TypeError, ValueError):
+        # sin motor Parquet, columnas con tipos mixtos o disco no escribible: se usa solo la caché en memoria
+        if tmp is not None:
+            tmp.unlink(missing_ok=True)
+    return df
+
 # Leer y normalizar columnas (minimiza errores por espacios/mayúsculas)
-inv = pd.read_excel(inv_file)
-forc = pd.read_excel(for_file)
+inv_bytes, for_bytes = inv_file.getvalue(), for_file.getvalue()
+inv = load_excel(inv_bytes)
+forc = load_excel(for_bytes)
+# clave exacta de los datos cargados (st.cache_data solo muestrea las filas de DataFrames grandes al hashearlos)
+datos_key = (hashlib.sha1(inv_bytes).hexdigest(), hashlib.sha1(for_bytes).hexdigest())
 
 inv.columns = inv.columns.str.strip().str.lower()
 forc.columns = forc.columns.str.strip().str.lower()
@@ -41,19 +77,30 @@ if not req_for.issubset(set(forc.columns)):
 
 # Normalizar tipos
 forc["fecha"] = pd.to_datetime(forc["fecha"])
+# bodega/producto como categóricas con categorías compartidas (groupby/merge sobre códigos enteros)
+for col in ["bodega", "producto"]:
+    cat_dtype = pd.CategoricalDtype(sorted(pd.concat([inv[col], forc[col]]).dropna().unique()))
+    inv[col] = inv[col].astype(cat_dtype)
+    forc[col] = forc[col].astype(cat_dtype)
 # Agrupar duplicados si existen
-inv = inv.groupby(["bodega", "producto"], as_index=False).agg({
+inv = inv.groupby(["bodega", "producto"], as_index=False, sort=False, observed=True).agg({
     "inventario_actual": "sum",
     "stock_seguridad": "mean",
     "lead_time": "mean"
 })
-forc = forc.groupby(["bodega", "producto", "fecha"], as_index=False).agg({
+forc = forc.groupby(["bodega", "producto", "fecha"], as_index=False, sort=False, observed=True).agg({
     "pronostico_ventas": "sum"
 })
+# fecha normalizada como int64 (ns): clave entera para cruzar entregas sin comparar Timestamps
+forc["fecha_norm_i8"] = forc["fecha"].dt.normalize().astype("int64")
 
-# Merge base
+# Merge base (se ordena una sola vez; los groupby posteriores usan sort=False)
 base = forc.merge(inv, on=["bodega", "producto"], how="left")
 base = base.sort_values(["bodega", "producto", "fecha"]).reset_index(drop=True)
+if base.empty:
+    # pronóstico sin filas utilizables (solo encabezados o sin fechas): no hay nada que proyectar
+    st.warning("El archivo de pronóstico no tiene filas utilizables (sin datos o sin fechas en la columna Fecha).")
+    st.stop()
 
 # --------------------
 # Session state: historial de compras (lista de dicts)
@@ -64,55 +111,97 @@ if "compras" not in st.session_state:
 # --------------------
 # Helper: reconstruir datos activos aplicando compras (en fecha_entrega)
 # --------------------
-def build_active(base_df, compras_list):
-    df = base_df.copy()
-    df["inventario_proyectado"] = np.nan
-
-    # crear dict de entregas por (bodega,producto) -> {fecha_entrega(datetime.date normalized): cantidad_on_that_day}
-    entregas = {}
-    for c in compras_list:
-        key = (c["bodega"], c["producto"])
-        fecha_ent = pd.Timestamp(c["fecha_entrega"]).normalize()
-        entregas.setdefault(key, {})
-        entregas[key][fecha_ent] = entregas[key].get(fecha_ent, 0) + float(c["cantidad"])
-
-    # calcular por grupo sin duplicar entregas (sumar solo lo entregado en la fecha actual)
-    for (b, p), grp in df.groupby(["bodega", "producto"]):
-        grp = grp.sort_values("fecha").copy()
-        inv_temp = float(grp["inventario_actual"].iloc[0]) if not pd.isna(grp["inventario_actual"].iloc[0]) else 0.0
-        inv_proj = []
-        key = (b, p)
-        deliveries_for_key = entregas.get(key, {})
-
-        for idx, row in grp.iterrows():
-            fecha_actual = pd.Timestamp(row["fecha"]).normalize()
-            recibidos_hoy = deliveries_for_key.get(fecha_actual, 0.0)
-            inv_temp += recibidos_hoy
-            inv_temp -= float(row["pronostico_ventas"])
-            inv_proj.append(inv_temp)
-
-        df.loc[grp.index, "inventario_proyectado"] = inv_proj
-
-    # punto de reorden: stock_seguridad + pronostico_ventas * lead_time (mismo criterio anterior)
-    df["punto_reorden"] = df["stock_seguridad"] + df["pronostico_ventas"] * df["lead_time"]
-    df["alerta"] = df["inventario_proyectado"] <= df["punto_reorden"]
-
-    return df
+def compras_key(compras_list):
+    # representación hashable de las compras: (bodega, producto, fecha_entrega, cantidad)
+    return tuple((c["bodega"], c["producto"], pd.Timestamp(c["fecha_entrega"]), float(c["cantidad"])) for c in compras_list)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_active(_base_df, datos_key, compras):
+    # _base_df no se hashea: la caché se indexa por datos_key (digest de los archivos) y las compras
+    keys = ["bodega", "producto"]
+    grupos = [_base_df["bodega"], _base_df["producto"]]
+
+    # entregas por (bodega, producto, fecha_entrega normalizada)
+    entregas = pd.DataFrame(list(compras), columns=["bodega", "producto", "fecha_norm", "recibidos"])
+    entregas["fecha_norm"] = pd.to_datetime(entregas["fecha_norm"]).dt.normalize().astype("int64")
+    entregas = entregas.astype({"bodega": _base_df["bodega"].dtype, "producto": _base_df["producto"].dtype, "recibidos": "float64"})
+
+    # grupos contiguos (base ya viene ordenada): limites[g] es la primera fila del grupo g y limites[g + 1] su fin
+    codigos = _base_df.groupby(keys, sort=False, observed=True).ngroup().to_numpy()
+    limites = np.flatnonzero(np.r_[True, codigos[1:] != codigos[:-1], True])
+    claves = pd.MultiIndex.from_frame(_base_df.iloc[limites[:-1]][keys])
+    g = claves.get_indexer(pd.MultiIndex.from_frame(entregas[keys]))
+    entregas, g = entregas[g >= 0], g[g >= 0]
+
+    # cada entrega cae en la primera fecha del pronóstico >= fecha_entrega de su grupo: searchsorted sobre
+    # una clave compuesta creciente (grupo, día); las entregas posteriores al horizonte quedan fuera (pos == fin)
+    dia = 86_400_000_000_000
+    dias = _base_df["fecha_norm_i8"].to_numpy() // dia
+    d0, span = dias.min(), dias.max() - dias.min() + 2
+    compuesto = codigos * span + (dias - d0)
+    pos = np.searchsorted(compuesto, g * span + np.clip(entregas["fecha_norm"].to_numpy() // dia - d0, 0, span - 1))
+    dentro = pos < limites[g + 1]
+
+    # np.add.at acumula varias entregas sobre la misma fila
+    recibidos = np.zeros(len(_base_df))
+    np.add.at(recibidos, pos[dentro], entregas["recibidos"].to_numpy()[dentro])
+    recibidos = pd.Series(recibidos, index=_base_df.index)
+
+    # inventario proyectado = inventario inicial + acumulado (recibidos - ventas) por grupo (base ya viene ordenada por fecha)
+    inv0 = _base_df.groupby(keys, sort=False, observed=True)["inventario_actual"].transform("first").fillna(0.0)
+    delta = recibidos - _base_df["pronostico_ventas"]
+    inventario_proyectado = (inv0 + delta.groupby(grupos, sort=False, observed=True).cumsum()).to_numpy()
+
+    # punto de reorden: stock_seguridad + pronostico_ventas * lead_time (mismo criterio anterior), sobre arrays NumPy
+    punto_reorden = _base_df["stock_seguridad"].to_numpy() + _base_df["pronostico_ventas"].to_numpy() * _base_df["lead_time"].to_numpy()
+
+    # assign devuelve un DataFrame nuevo con las columnas agregadas (_base_df no se modifica)
+    return _base_df.assign(
+        recibidos=recibidos,
+        inventario_proyectado=inventario_proyectado,
+        punto_reorden=punto_reorden,
+        alerta=inventario_proyectado <= punto_reorden,
+    )
 
-# construir datos activos
-active = build_active(base, st.session_state["compras"])
+def aplicar_compra(active_df, bodega, producto, fecha_entrega, cantidad):
+    # actualización incremental (modifica active_df): una compra solo afecta a su (bodega, producto) desde la fecha de entrega
+    fecha_norm = active_df["fecha_norm_i8"]
+    fecha_ent = pd.Timestamp(fecha_entrega).normalize().value
+    grupo = (active_df["bodega"] == bodega) & (active_df["producto"] == producto)
+    mask = grupo & (fecha_norm >= fecha_ent)
+    if not mask.any():
+        # entrega posterior al horizonte del pronóstico: no afecta la proyección
+        return
+    # mismo criterio que build_active: se recibe en la primera fecha del pronóstico >= fecha de entrega
+    active_df.loc[mask.idxmax(), "recibidos"] += cantidad
+    active_df.loc[mask, "inventario_proyectado"] += cantidad
+    active_df.loc[mask, "alerta"] = active_df.loc[mask, "inventario_proyectado"] <= active_df.loc[mask, "punto_reorden"]
+
+# construir datos activos (se conservan en la sesión; solo se reconstruyen si cambian los archivos o las compras)
+def firma_activa():
+    return (datos_key, compras_key(st.session_state["compras"]))
+
+if st.session_state.get("active_firma") != firma_activa():
+    st.session_state["active"] = build_active(base, datos_key, compras_key(st.session_state["compras"]))
+    st.session_state["active_firma"] = firma_activa()
+active = st.session_state["active"]
 
 # --------------------
 # Filtros UI (manteniendo tu interfaz)
 # --------------------
 st.sidebar.subheader("🔍 Filtros")
-bodegas = sorted(active["bodega"].unique())
-productos = sorted(active["producto"].unique())
+
+# opciones de filtro cacheadas por el digest de los archivos (las compras no cambian bodegas ni productos)
+@st.cache_data(show_spinner=False)
+def opciones_filtro(_active_df, datos_key):
+    return sorted(_active_df["bodega"].unique()), sorted(_active_df["producto"].unique())
+
+bodegas, productos = opciones_filtro(active, datos_key)
 
 f_bodegas = st.sidebar.multiselect("Selecciona bodegas:", bodegas, default=bodegas)
 f_productos = st.sidebar.multiselect("Selecciona productos:", productos, default=productos)
 
-df_filtered = active[active["bodega"].isin(f_bodegas) & active["producto"].isin(f_productos)].copy()
+df_filtered = active[active["bodega"].isin(f_bodegas) & active["producto"].isin(f_productos)]
 if df_filtered.empty:
     st.warning("No hay datos con los filtros seleccionados.")
     st.stop()
@@ -126,7 +215,7 @@ col1, col2, col3, col4 = st.columns(4)
 with col1:
     b_sel = col1.selectbox("Bodega (registro)", sorted(df_filtered["bodega"].unique()))
 with col2:
-    p_sel = col2.selectbox("Producto (registro)", sorted(df_filtered[df_filtered["bodega"] == b_sel]["producto"].unique()))
+    p_sel = col2.selectbox("Producto (registro)", sorted(df_filtered.loc[df_filtered["bodega"] == b_sel, "producto"].unique()))
 with col3:
     fecha_compra = col3.date_input("Fecha de compra", value=df_filtered["fecha"].min().date())
 with col4:
@@ -153,46 +242,43 @@ if st.button("✅ Registrar compra y recalcular"):
         "cantidad": float(cantidad)
     })
 
-    # reconstruir datos activos con nueva compra
-    active = build_active(base, st.session_state["compras"])
-    df_filtered = active[active["bodega"].isin(f_bodegas) & active["producto"].isin(f_productos)].copy()
+    # aplicar solo la nueva compra sobre los datos activos (sin recalcular todos los grupos)
+    aplicar_compra(active, b_sel, p_sel, fecha_entrega, float(cantidad))
+    st.session_state["active_firma"] = firma_activa()
+    df_filtered = active[active["bodega"].isin(f_bodegas) & active["producto"].isin(f_productos)]
 
     st.success(f"Compra registrada: {cantidad} u. de {p_sel} en {b_sel} (entrega {fecha_entrega.date()}).")
 
 # --------------------
 # Resumen dinámico (actualiza en base a 'active')
 # --------------------
-resumen_rows = []
-for (b, p), grp in active.groupby(["bodega", "producto"]):
-    grp = grp.sort_values("fecha").copy()
-    mask_alert = grp["inventario_proyectado"] <= grp["punto_reorden"]
-    if mask_alert.any():
-        # primera fecha de alerta
-        first_idx = mask_alert.idxmax()  # devuelve primer índice donde True
-        fecha_reorden = grp.loc[first_idx, "fecha"]
-        inv_en_fecha = grp.loc[first_idx, "inventario_proyectado"]
-        stock_seg = grp.loc[first_idx, "stock_seguridad"]
-        cantidad_sugerida = max(stock_seg * 2 - inv_en_fecha, 0)
-    else:
-        fecha_reorden = pd.NaT
-        cantidad_sugerida = 0.0
-
-    dias = int((pd.to_datetime(fecha_reorden).normalize() - pd.Timestamp.now().normalize()).days) if pd.notna(fecha_reorden) else None
-    estado = "🔴 Reorden" if dias is not None and dias <= 0 else ("🟡 Cerca" if dias is not None and dias <= 5 else "🟢 OK")
-
-    resumen_rows.append({
-        "Bodega": b,
-        "Producto": p,
-        "Inventario_Actual": float(grp["inventario_actual"].iloc[0]),
-        "Stock_Seguridad": float(grp["stock_seguridad"].iloc[0]),
-        "Lead_Time": float(grp["lead_time"].iloc[0]),
-        "Fecha_Siguiente_Compra": fecha_reorden if pd.notna(fecha_reorden) else None,
-        "Cantidad_Sugerida_Pedir": float(cantidad_sugerida),
-        "Días_Hasta_Punto_Reorden": dias,
+def build_resumen(active_df):
+    keys = ["bodega", "producto"]
+    grupos = active_df.groupby(keys, as_index=False, sort=False, observed=True)[["inventario_actual", "stock_seguridad", "lead_time"]].first()
+
+    # primera fecha de alerta por grupo (active_df ya viene ordenado por fecha dentro de cada grupo)
+    primeras = active_df.loc[active_df["alerta"], keys + ["fecha", "inventario_proyectado", "stock_seguridad"]]
+    primeras = primeras.drop_duplicates(keys).rename(columns={"stock_seguridad": "stock_alerta"})
+    primeras["cantidad_sugerida"] = np.maximum(primeras["stock_alerta"] * 2 - primeras["inventario_proyectado"], 0)
+
+    res = grupos.merge(primeras, on=keys, how="left")
+    res["cantidad_sugerida"] = res["cantidad_sugerida"].fillna(0.0)
+    dias = (res["fecha"].dt.normalize() - pd.Timestamp.now().normalize()).dt.days
+    estado = np.select([dias <= 0, dias <= 5], ["🔴 Reorden", "🟡 Cerca"], default="🟢 OK")
+
+    return pd.DataFrame({
+        "Bodega": res["bodega"],
+        "Producto": res["producto"],
+        "Inventario_Actual": res["inventario_actual"].astype(float),
+        "Stock_Seguridad": res["stock_seguridad"].astype(float),
+        "Lead_Time": res["lead_time"].astype(float),
+        "Fecha_Siguiente_Compra": res["fecha"],
+        "Cantidad_Sugerida_Pedir": res["cantidad_sugerida"].astype(float),
+        "Días_Hasta_Punto_Reorden": dias.astype("Int64"),
         "Estado": estado
     })
 
-resumen_df = pd.DataFrame(resumen_rows)
+resumen_df = build_resumen(active)
 
 # Mostrar resumen (principal)
 st.subheader("📋 Resumen de próximas compras sugeridas (actualizado)")
@@ -204,7 +290,7 @@ st.dataframe(resumen_df, use_container_width=True)
 st.markdown("---")
 st.subheader("🧾 Historial de compras simuladas (esta sesión)")
 if st.session_state["compras"]:
-    compras_df = pd.DataFrame(st.session_state["compras"]).copy()
+    compras_df = pd.DataFrame(st.session_state["compras"])
     # mostrar fechas legibles
     compras_df["fecha_compra"] = pd.to_datetime(compras_df["fecha_compra"]).dt.date
     compras_df["fecha_entrega"] = pd.to_datetime(compras_df["fecha_entrega"]).dt.date
@@ -212,16 +298,21 @@ if st.session_state["compras"]:
 else:
     st.write("No hay compras registradas en esta sesión.")
 
-# Botón para descargar historial
-if st.session_state["compras"]:
+# Botón para descargar historial (el Excel se genera solo cuando cambian los datos, no en cada rerun)
+@st.cache_data(show_spinner=False, max_entries=4)
+def export_excel(resumen, _proyeccion, firma, compras_df):
+    # _proyeccion no se hashea: queda determinada por firma (digest de los archivos + compras)
     buf = BytesIO()
     with pd.ExcelWriter(buf, engine="xlsxwriter") as writer:
-        resumen_df.to_excel(writer, index=False, sheet_name="Resumen")
-        active.to_excel(writer, index=False, sheet_name="Inventario_Proyectado")
-        pd.DataFrame(st.session_state["compras"]).to_excel(writer, index=False, sheet_name="Compras_Simuladas")
+        resumen.to_excel(writer, index=False, sheet_name="Resumen")
+        _proyeccion.drop(columns="fecha_norm_i8").to_excel(writer, index=False, sheet_name="Inventario_Proyectado")
+        compras_df.to_excel(writer, index=False, sheet_name="Compras_Simuladas")
+    return buf.getvalue()
+
+if st.session_state["compras"]:
     st.download_button(
         label="⬇️ Descargar datos (Resumen + Proyección + Compras)",
-        data=buf.getvalue(),
+        data=export_excel(resumen_df, active, firma_activa(), pd.DataFrame(st.session_state["compras"])),
         file_name="resumen_proyeccion_compras.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
@@ -232,59 +323,55 @@ if st.session_state["compras"]:
 st.markdown("---")
 st.subheader("📈 Inventario proyectado vs Punto de Reorden (filtrado)")
 
-# Asegurar que df_filtered tenga fechas tipo datetime
-df_filtered["fecha"] = pd.to_datetime(df_filtered["fecha"], errors="coerce")
-
-fig = px.line(
-    df_filtered,
-    x="fecha",
-    y="inventario_proyectado",
-    color="producto",
-    line_shape="spline",
-    markers=True,
-    facet_col="bodega",
-    title="Evolución inventario proyectado (por producto y bodega)"
-)
-
-# Añadir líneas de stock por bodega y marcadores de reorden + marcadores de compras entregadas
-for bodega in df_filtered["bodega"].unique():
-    stock_val = float(df_filtered.loc[df_filtered["bodega"] == bodega, "stock_seguridad"].mean())
-    fig.add_hline(y=stock_val, line_dash="dot", line_color="red", annotation_text=f"Stock Seguridad ({bodega})", annotation_position="bottom right")
-
-    # marcar la(s) fecha(s) de reorden por producto en este bodega (si existen en resumen_df)
-    filas = resumen_df[resumen_df["Bodega"] == bodega]
-    for _, r in filas.iterrows():
-        f = r["Fecha_Siguiente_Compra"]
-        if f is not None and not (pd.isna(f)):
-            # convertir a datetime nativo
-            fecha_dt = pd.to_datetime(f)
-            fecha_py = fecha_dt.to_pydatetime()
-            # tratar de obtener y mostrar valor proyectado en esa fecha (si existe)
-            df_match = df_filtered[(df_filtered["bodega"] == bodega) & (df_filtered["producto"] == r["Producto"]) & (df_filtered["fecha"] == fecha_dt)]
-            y_val = float(df_match["inventario_proyectado"].iloc[0]) if not df_match.empty else float(r["Stock_Seguridad"])
-            # marcador/etiqueta
-            fig.add_scatter(x=[fecha_py], y=[y_val], mode="markers+text",
-                            marker=dict(color="orange", size=10), text=[f"Reorden {r['Producto']}"],
-                            textposition="top center", showlegend=False)
-
-# marcar compras entregadas en gráfico (por filtro)
-for c in st.session_state["compras"]:
-    # solo mostrar compras para bodegas/productos que están en el filtro
-    if c["bodega"] in df_filtered["bodega"].unique() and c["producto"] in df_filtered["producto"].unique():
-        fecha_ent = pd.to_datetime(c["fecha_entrega"])
-        fecha_py = fecha_ent.to_pydatetime()
-        # y_pos: buscar inventario proyectado en esa fecha para mostrar el marcador; si no existe, usar NaN y Plotly lo ignora
-        df_m = df_filtered[(df_filtered["bodega"] == c["bodega"]) & (df_filtered["producto"] == c["producto"]) & (df_filtered["fecha"] == fecha_ent)]
-        if not df_m.empty:
-            y_pos = float(df_m["inventario_proyectado"].iloc[0])
-            fig.add_scatter(x=[fecha_py], y=[y_pos], mode="markers+text",
-                            marker=dict(color="green", size=10), text=[f"Compra +{int(c['cantidad'])}"],
-                            textposition="bottom center", showlegend=False)
-        else:
-            # si no hay fila exacta, añadir la anotación en la coordenada y = stock para referencia visual
-            y_pos = float(df_filtered.loc[df_filtered["bodega"] == c["bodega"], "stock_seguridad"].mean())
-            fig.add_scatter(x=[fecha_py], y=[y_pos], mode="markers+text",
-                            marker=dict(color="green", size=8), text=[f"Compra +{int(c['cantidad'])}"],
-                            textposition="bottom center", showlegend=False)
+# una traza WebGL por (bodega, producto), una columna por bodega; mismo color por producto en todas las columnas
+bodegas_graf = list(df_filtered["bodega"].unique())
+colores = {p: qualitative.Plotly[i % len(qualitative.Plotly)] for i, p in enumerate(df_filtered["producto"].unique())}
+fig = make_subplots(rows=1, cols=len(bodegas_graf), shared_yaxes=True, subplot_titles=[f"bodega={b}" for b in bodegas_graf])
+en_leyenda = set()
+for (bodega, producto), grp in df_filtered.groupby(["bodega", "producto"], sort=False, observed=True):
+    fig.add_trace(go.Scattergl(x=grp["fecha"], y=grp["inventario_proyectado"], mode="lines+markers", name=str(producto),
+                               legendgroup=str(producto), showlegend=producto not in en_leyenda, line=dict(color=colores[producto])),
+                  row=1, col=bodegas_graf.index(bodega) + 1)
+    en_leyenda.add(producto)
+fig.update_xaxes(matches="x")
+fig.update_layout(title="Evolución inventario proyectado (por producto y bodega)", legend_title_text="producto")
+
+# Añadir líneas de stock por bodega
+stock_bodega = df_filtered.groupby("bodega", sort=False, observed=True)["stock_seguridad"].mean()
+for bodega, stock_val in stock_bodega.items():
+    fig.add_hline(y=float(stock_val), line_dash="dot", line_color="red", annotation_text=f"Stock Seguridad ({bodega})", annotation_position="bottom right")
+
+# índice (bodega, producto, fecha) -> inventario proyectado, para ubicar los marcadores con búsquedas hash
+lookup = df_filtered.set_index(["bodega", "producto", "fecha"])["inventario_proyectado"]
+
+# marcadores de reorden (una sola traza): fecha de reorden por producto en las bodegas filtradas
+reorden = resumen_df[resumen_df["Bodega"].isin(stock_bodega.index) & resumen_df["Fecha_Siguiente_Compra"].notna()]
+if not reorden.empty:
+    # valor proyectado en esa fecha (si existe); si no, el stock de seguridad del producto
+    y_val = lookup.reindex(pd.MultiIndex.from_frame(reorden[["Bodega", "Producto", "Fecha_Siguiente_Compra"]])).to_numpy()
+    fig.add_scatter(x=reorden["Fecha_Siguiente_Compra"], y=np.where(np.isnan(y_val), reorden["Stock_Seguridad"], y_val),
+                    mode="markers+text", marker=dict(color="orange", size=10), text="Reorden " + reorden["Producto"].astype(str),
+                    textposition="top center", showlegend=False)
+
+# marcadores de compras entregadas (una sola traza), solo para bodegas/productos que están en el filtro
+if st.session_state["compras"]:
+    compras_plot = pd.DataFrame(st.session_state["compras"])
+    compras_plot = compras_plot[compras_plot["bodega"].isin(stock_bodega.index) & compras_plot["producto"].isin(df_filtered["producto"].unique())]
+    compras_plot = compras_plot.astype({"bodega": df_filtered["bodega"].dtype, "producto": df_filtered["producto"].dtype})
+    if not compras_plot.empty:
+        # ubicar cada compra donde build_active la recibe: primera fecha del pronóstico >= fecha_entrega en su grupo
+        compras_plot["fecha_norm_i8"] = compras_plot["fecha_entrega"].dt.normalize().astype("int64")
+        compras_plot = pd.merge_asof(
+            compras_plot.sort_values("fecha_norm_i8"),
+            df_filtered[["bodega", "producto", "fecha", "fecha_norm_i8", "inventario_proyectado"]].sort_values("fecha_norm_i8"),
+            on="fecha_norm_i8", by=["bodega", "producto"], direction="forward"
+        )
+        # entrega fuera del horizonte: marcador en fecha_entrega con y = stock de la bodega como referencia visual
+        encontrado = compras_plot["inventario_proyectado"].notna().to_numpy()
+        x_pos = compras_plot["fecha"].where(encontrado, compras_plot["fecha_entrega"])
+        y_pos = np.where(encontrado, compras_plot["inventario_proyectado"], stock_bodega.reindex(compras_plot["bodega"]).to_numpy())
+        fig.add_scatter(x=x_pos, y=y_pos, mode="markers+text",
+                        marker=dict(color="green", size=np.where(encontrado, 10, 8)), text="Compra +" + compras_plot["cantidad"].astype(int).astype(str),
+                        textposition="bottom center", showlegend=False)
 
 st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file